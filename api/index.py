@@ -1,5 +1,4 @@
-from http.server import BaseHTTPRequestHandler
-import json
+import orjson
 import requests
 from PIL import Image
 import io
@@ -7,79 +6,179 @@ import base64
 import numpy as np
 import faiss
 import os
+import fcntl
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import platform
 import logging
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# CDN URLs
+# FAISS picks its SIMD build at import; the scalar fallback is several times slower
+if platform.machine().lower() in ("x86_64", "amd64") and "AVX" not in faiss.get_compile_options():
+    logger.warning("FAISS loaded without AVX2/AVX512 kernels; check the faiss-cpu wheel and leave FAISS_OPT_LEVEL unset so the loader auto-detects")
+
+# CDN URLs; set CDN_ARTIFACT_SUFFIX=.zst to fetch zstd-compressed artifacts
 CDN_BASE_URL = "https://drive.charpstar.net/indexing-test"
-FAISS_INDEX_URL = f"{CDN_BASE_URL}/sample_index.faiss"
-METADATA_URL = f"{CDN_BASE_URL}/sample_metadata.json"
+CDN_ARTIFACT_SUFFIX = os.environ.get("CDN_ARTIFACT_SUFFIX", "")
+FAISS_INDEX_URL = f"{CDN_BASE_URL}/sample_index.faiss{CDN_ARTIFACT_SUFFIX}"
+METADATA_URL = f"{CDN_BASE_URL}/sample_metadata.json{CDN_ARTIFACT_SUFFIX}"
+
+# Persistent cache for the downloaded artifacts (/tmp is the only writable path on serverless)
+INDEX_CACHE_DIR = os.environ.get("FAISS_CACHE_DIR", "/tmp/faiss-cache")
+INDEX_PATH = os.path.join(INDEX_CACHE_DIR, "sample_index.faiss")
+METADATA_PATH = os.path.join(INDEX_CACHE_DIR, "sample_metadata.json")
+
+# Read-only mmap load; IO_FLAG_MMAP_IFC extends mmap to flat indexes on newer FAISS builds
+INDEX_IO_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+# Inverted lists probed per query on IVF indexes (recall/latency tradeoff)
+SEARCH_NPROBE = int(os.environ.get("FAISS_NPROBE", 16))
 
 # Global variables for index and metadata
 index = None
 metadata = None
 
+def download_cached(url, path, timeout=300):
+    """Stream a CDN artifact to a persistent path, skipping the download when the cached copy is current"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    # Serialize concurrent cold starts on the same host so only one of them downloads
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        
+        # Identify the remote artifact by ETag and size so warm containers reuse the cached file
+        try:
+            head = requests.head(url, timeout=30, allow_redirects=True)
+            head.raise_for_status()
+        except requests.RequestException as e:
+            # CDN unreachable: serve the last downloaded copy rather than failing the request
+            if os.path.exists(path):
+                logger.warning(f"Could not check {url} ({str(e)}), using cached {os.path.basename(path)}")
+                return path
+            raise
+        remote_tag = f"{head.headers.get('ETag', '')}:{head.headers.get('Content-Length', '')}"
+        tag_path = f"{path}.etag"
+        
+        if os.path.exists(path) and os.path.exists(tag_path):
+            with open(tag_path) as f:
+                if f.read() == remote_tag:
+                    logger.info(f"Using cached {os.path.basename(path)}")
+                    return path
+        
+        partial_path = f"{path}.part"
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(partial_path, "wb") as f:
+                if url.endswith(".zst"):
+                    # Decompress while streaming so neither copy is ever buffered in memory
+                    import zstandard
+                    with zstandard.ZstdDecompressor().stream_writer(f, closefd=False) as decompressor:
+                        for chunk in response.iter_content(chunk_size=1 << 20):
+                            decompressor.write(chunk)
+                else:
+                    for chunk in response.iter_content(chunk_size=1 << 20):
+                        f.write(chunk)
+        
+        # Atomic rename so an index that is already mmapped keeps a consistent view
+        os.replace(partial_path, path)
+        with open(tag_path, "w") as f:
+            f.write(remote_tag)
+    
+    return path
+
+@functools.lru_cache(maxsize=1)
+def fetch_index_and_metadata():
+    """Download and open the index and metadata once per process; failures raise and are retried"""
+    # Download FAISS index and metadata from CDN concurrently into the persistent cache
+    logger.info("Downloading FAISS index and metadata from CDN...")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        downloads = [
+            pool.submit(download_cached, FAISS_INDEX_URL, INDEX_PATH),
+            pool.submit(download_cached, METADATA_URL, METADATA_PATH, 60)
+        ]
+        for download in downloads:
+            download.result()
+    
+    # Memory-map the index so only the pages touched by searches become resident
+    loaded_index = faiss.read_index(INDEX_PATH, INDEX_IO_FLAGS)
+    configure_search_params(loaded_index)
+    logger.info(f"FAISS index loaded successfully with {loaded_index.ntotal} vectors")
+    
+    with open(METADATA_PATH, "rb") as f:
+        entries = orjson.loads(f.read())
+    
+    # Keep only the filename column; the rest of each entry is never read
+    loaded_metadata = [entry.get('filename', f'image_{i}.jpg') for i, entry in enumerate(entries)]
+    logger.info(f"Metadata loaded successfully with {len(loaded_metadata)} entries")
+    
+    return loaded_index, loaded_metadata
+
 def load_index():
     """Load FAISS index and metadata from CDN"""
     global index, metadata
     
     try:
-        # Download FAISS index from CDN
-        logger.info("Downloading FAISS index from CDN...")
-        index_response = requests.get(FAISS_INDEX_URL, timeout=300)
-        index_response.raise_for_status()
-        
-        # Save index temporarily and load it
-        with open("/tmp/temp_index.faiss", "wb") as f:
-            f.write(index_response.content)
-        index = faiss.read_index("/tmp/temp_index.faiss")
-        os.remove("/tmp/temp_index.faiss")  # Clean up
-        logger.info(f"FAISS index loaded successfully with {index.ntotal} vectors")
-        
-        # Download metadata from CDN
-        logger.info("Downloading metadata from CDN...")
-        metadata_response = requests.get(METADATA_URL, timeout=60)
-        metadata_response.raise_for_status()
-        metadata = metadata_response.json()
-        logger.info(f"Metadata loaded successfully with {len(metadata)} entries")
-        
+        index, metadata = fetch_index_and_metadata()
         return True
         
     except Exception as e:
         logger.error(f"Failed to load index from CDN: {str(e)}")
         return False
 
+def configure_search_params(index):
+    """Apply query-time parameters for approximate indexes"""
+    try:
+        faiss.extract_index_ivf(index).nprobe = SEARCH_NPROBE
+    except RuntimeError:
+        pass  # Not an IVF index, nothing to tune
+
+def scores_to_similarity(scores):
+    """Convert raw FAISS scores to cosine similarity"""
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return scores
+    
+    # Legacy L2 indexes hold unit vectors, where ||a - b||^2 = 2 - 2 * cos
+    return 1.0 - scores / 2.0
+
 def search_similar_images(query_embedding, top_k=10):
     """Search for similar images using FAISS"""
     global index, metadata
     
-    if index is None or metadata is None:
-        if not load_index():
-            return []
+    # Memoized: warm invocations reuse the loaded index without touching the network
+    if not load_index():
+        return []
     
     try:
-        # Convert query embedding to numpy array
+        # Convert query embedding to a unit-norm numpy array
         query_vector = np.array([query_embedding], dtype=np.float32)
+        faiss.normalize_L2(query_vector)
         
         # Search in FAISS index
-        distances, indices = index.search(query_vector, top_k)
+        scores, indices = index.search(query_vector, top_k)
+        
+        # Drop padding ids (-1) and ids without metadata, then convert to Python scalars in bulk
+        ids = indices[0]
+        mask = (ids >= 0) & (ids < len(metadata))
+        similarities = scores_to_similarity(scores[0][mask])
+        ids = ids[mask].tolist()
         
         # Format results
-        results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(metadata):
-                similarity = 1.0 - distance  # Convert distance to similarity
-                filename = metadata[idx].get('filename', f'image_{idx}.jpg')
-                
-                results.append({
-                    'index': int(idx),
-                    'filename': filename,
-                    'similarity': float(similarity),
-                    'distance': float(distance)
-                })
+        results = [
+            {
+                'index': idx,
+                'filename': metadata[idx],
+                'similarity': similarity,
+                'distance': distance
+            }
+            for idx, similarity, distance in zip(ids, similarities.tolist(), (1.0 - similarities).tolist())
+        ]
         
         return results
         
@@ -87,89 +186,63 @@ def search_similar_images(query_embedding, top_k=10):
         logger.error(f"Search failed: {str(e)}")
         return []
 
-class handler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        """Handle POST requests for search"""
-        try:
-            # Get content length
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            
-            # Parse JSON data
-            data = json.loads(post_data.decode('utf-8'))
-            
-            # Handle different request types
-            if 'embedding' in data:
-                # Search with embedding
-                query_embedding = data['embedding']
-                results = search_similar_images(query_embedding)
-                
-                response = {
-                    'success': True,
-                    'results': results,
-                    'total_results': len(results)
-                }
-                
-            elif 'text' in data:
-                # Text search (placeholder)
-                response = {
-                    'success': True,
-                    'results': [],
-                    'total_results': 0,
-                    'message': 'Text search not implemented yet'
-                }
-                
-            else:
-                response = {
-                    'success': False,
-                    'error': 'Invalid request format'
-                }
-            
-            # Send response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
+# ASGI app served by the Vercel Python runtime; orjson serializes every response
+app = FastAPI(default_response_class=ORJSONResponse)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["POST", "GET", "OPTIONS"],
+    allow_headers=["Content-Type"],
+)
+
+@app.get("/health")
+async def health():
+    """Handle GET requests for health check"""
+    return {
+        'status': 'healthy',
+        'service': 'image-similarity-backend',
+        'index_loaded': index is not None,
+        'metadata_loaded': metadata is not None
+    }
+
+@app.post("/{path:path}")
+async def search(request: Request, path: str):
+    """Handle POST requests for search"""
+    try:
+        # Parse JSON data
+        data = orjson.loads(await request.body())
+        
+        # Handle different request types
+        if 'embedding' in data:
+            # Search with embedding; index loading and FAISS run off the event loop
+            query_embedding = data['embedding']
+            results = await run_in_threadpool(search_similar_images, query_embedding)
             
-        except Exception as e:
-            # Send error response
-            error_response = {
-                'success': False,
-                'error': str(e)
+            return {
+                'success': True,
+                'results': results,
+                'total_results': len(results)
             }
             
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(error_response).encode())
-    
-    def do_GET(self):
-        """Handle GET requests for health check"""
-        if self.path == '/health':
-            response = {
-                'status': 'healthy',
-                'service': 'image-similarity-backend',
-                'index_loaded': index is not None,
-                'metadata_loaded': metadata is not None
+        elif 'text' in data:
+            # Text search (placeholder)
+            return {
+                'success': True,
+                'results': [],
+                'total_results': 0,
+                'message': 'Text search not implemented yet'
             }
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
         else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def do_OPTIONS(self):
-        """Handle CORS preflight requests"""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers() 
\ No newline at end of file
+            return {
+                'success': False,
+                'error': 'Invalid request format'
+            }
+        
+    except Exception as e:
+        # Send error response
+        return ORJSONResponse(status_code=500, content={
+            'success': False,
+            'error': str(e)
+        })
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import torch
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """
+    Collect concurrent single-item requests into one batched model call
+
+    Requests are queued as (tensor, future) pairs. A background task waits for the first item,
+    keeps collecting until max_batch_size items arrive or max_wait_ms passes, runs one batched
+    call in a worker thread, and hands each caller its own entry of the result. process_batch
+    returns one result per input row and should finish all device work (e.g. the copy to host)
+    so the event loop never waits on the GPU.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[torch.Tensor], Sequence[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def start(self):
+        """Start the worker thread and the background batching task on the running event loop"""
+        # One dedicated thread: thread-local model state (e.g. Inductor CUDA graphs) is recorded once
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="microbatch")
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the background batching task and release the worker thread"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def run_on_worker(self, fn: Callable[..., Any], *args) -> Any:
+        """Run a call on the batch worker thread, e.g. model warm-up or other model calls"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def submit(self, item: torch.Tensor) -> Any:
+        """
+        Queue one input of shape (1, ...) and wait for its result
+
+        Args:
+            item: Single-item batch tensor
+
+        Returns:
+            The entry process_batch produced for this row
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[torch.Tensor, asyncio.Future]]:
+        """Wait for one item, then gather more until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return items
+
+    async def _run(self):
+        """Batching loop"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            items = await self._collect()
+
+            # A bad batch (mismatched shapes, OOM, ...) fails only its own callers; the loop keeps running
+            try:
+                batch = torch.cat([item for item, _ in items])
+
+                # Run the model off the event loop so new requests keep queuing meanwhile
+                outputs = await loop.run_in_executor(self.executor, self.process_batch, batch)
+
+                for row, (_, future) in enumerate(items):
+                    if not future.done():  # Caller may have gone away
+                        future.set_result(outputs[row])
+            except Exception as e:
+                logger.error(f"Batched call failed for {len(items)} items: {str(e)}")
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
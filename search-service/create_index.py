@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Build the FAISS index and metadata from a directory of images
+"""
+
+import os
+import glob
+import json
+import logging
+import argparse
+from typing import List
+import numpy as np
+import faiss
+import pyarrow as pa
+import torch
+from PIL import Image
+from transformers import CLIPProcessor, CLIPModel
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "openai/clip-vit-base-patch32"
+IMAGE_EXTENSIONS = ['*.jpg', '*.jpeg', '*.png', '*.webp']
+
+# Below this size an exact flat scan is fast enough and IVF training data is too thin
+IVF_MIN_VECTORS = 100_000
+
+def choose_index_spec(n_vectors: int) -> str:
+    """Pick a FAISS index_factory string for the corpus size"""
+    if n_vectors < IVF_MIN_VECTORS:
+        return "Flat"
+    
+    # ~4*sqrt(N) inverted lists, capped so each list keeps enough training points
+    nlist = min(4096, 1 << int(np.log2(4 * np.sqrt(n_vectors))))
+    return f"IVF{nlist},PQ64"
+
+class IndexCreator:
+    """Embed images with CLIP and write them to a cosine-similarity FAISS index"""
+
+    def __init__(self, batch_size: int = 32, index_spec: str = "auto"):
+        self.batch_size = batch_size
+        self.index_spec = index_spec
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+
+        logger.info("Loading CLIP model...")
+        self.model = CLIPModel.from_pretrained(MODEL_NAME).to(self.device).eval()
+        self.processor = CLIPProcessor.from_pretrained(MODEL_NAME)
+        logger.info(f"CLIP model loaded successfully on {self.device}")
+
+    def find_images(self, images_dir: str) -> List[str]:
+        """Collect image files from a directory in a stable order"""
+        image_files = set()
+        for ext in IMAGE_EXTENSIONS:
+            image_files.update(glob.glob(os.path.join(images_dir, ext)))
+            image_files.update(glob.glob(os.path.join(images_dir, ext.upper())))
+        return sorted(image_files)
+
+    def embed_images(self, image_files: List[str]) -> np.ndarray:
+        """Generate L2-normalized CLIP embeddings for a list of image files"""
+        embeddings = []
+        for start in range(0, len(image_files), self.batch_size):
+            batch_files = image_files[start:start + self.batch_size]
+            images = [Image.open(path).convert('RGB') for path in batch_files]
+
+            inputs = self.processor(images=images, return_tensors="pt")
+            with torch.no_grad():
+                features = self.model.get_image_features(inputs['pixel_values'].to(self.device))
+            embeddings.append(features.cpu().numpy().astype(np.float32))
+
+            logger.info(f"Embedded {min(start + self.batch_size, len(image_files))}/{len(image_files)} images")
+
+        xb = np.ascontiguousarray(np.concatenate(embeddings))
+
+        # Unit-norm vectors make inner product equal to cosine similarity
+        faiss.normalize_L2(xb)
+        return xb
+
+    def write_filenames_arrow(self, filenames: List[str], path: str):
+        """Write filenames as a single-column Arrow IPC file the service can memory-map"""
+        schema = pa.schema([pa.field("filename", pa.string())])
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_batch(pa.record_batch([pa.array(filenames, type=pa.string())], schema=schema))
+
+    def create_index_from_images(self, images_dir: str, output_dir: str) -> bool:
+        """Create sample_index.faiss and sample_metadata.json from an images directory"""
+        try:
+            image_files = self.find_images(images_dir)
+            if not image_files:
+                logger.error(f"No images found in {images_dir}")
+                return False
+
+            logger.info(f"Found {len(image_files)} images in {images_dir}")
+            xb = self.embed_images(image_files)
+
+            # Inner-product index: scores returned by search are cosine similarities
+            spec = choose_index_spec(len(xb)) if self.index_spec == "auto" else self.index_spec
+            logger.info(f"Building {spec} index")
+            index = faiss.index_factory(xb.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+            index.train(xb)
+            index.add(xb)
+
+            metadata = [
+                {
+                    "index": i,
+                    "filename": os.path.basename(path),
+                    "filepath": path,
+                    "embedding_norm": float(np.linalg.norm(xb[i]))
+                }
+                for i, path in enumerate(image_files)
+            ]
+
+            os.makedirs(output_dir, exist_ok=True)
+            faiss.write_index(index, os.path.join(output_dir, "sample_index.faiss"))
+            with open(os.path.join(output_dir, "sample_metadata.json"), "w") as f:
+                json.dump(metadata, f, indent=2)
+            self.write_filenames_arrow(
+                [entry["filename"] for entry in metadata],
+                os.path.join(output_dir, "sample_metadata.arrow")
+            )
+
+            logger.info(f"Index created with {index.ntotal} vectors")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to create index: {str(e)}")
+            return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create FAISS index from images")
+    parser.add_argument("--images-dir", default="../sample-images", help="Directory containing images")
+    parser.add_argument("--output-dir", default=".", help="Directory to write the index and metadata")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per CLIP forward pass")
+    parser.add_argument("--index-type", default="auto",
+                        help="FAISS index_factory string, e.g. 'IVF4096,PQ64', 'SQfp16' or 'HNSW32' (default: by corpus size)")
+    args = parser.parse_args()
+
+    creator = IndexCreator(batch_size=args.batch_size, index_spec=args.index_type)
+    creator.create_index_from_images(args.images_dir, args.output_dir)
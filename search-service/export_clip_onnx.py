@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Export the CLIP vision tower to ONNX for serving with ONNX Runtime
+"""
+
+import logging
+import argparse
+import torch
+from transformers import CLIPModel
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "openai/clip-vit-base-patch32"
+
+class CLIPImageFeatures(torch.nn.Module):
+    """Vision tower plus projection, matching CLIPModel.get_image_features"""
+
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+def export(output_path: str, opset: int = 17):
+    """Trace get_image_features and write it as an ONNX graph with a dynamic batch axis"""
+    # FP16 tracing needs CUDA kernels; a CPU export stays FP32
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    if dtype != torch.float16:
+        logger.warning("CUDA not available, exporting an FP32 graph")
+
+    model = CLIPModel.from_pretrained(MODEL_NAME).to(device, dtype=dtype).eval()
+    dummy = torch.zeros(1, 3, 224, 224, device=device, dtype=dtype)
+
+    with torch.inference_mode():
+        torch.onnx.export(
+            CLIPImageFeatures(model),
+            (dummy,),
+            output_path,
+            opset_version=opset,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}}
+        )
+
+    logger.info(f"Exported CLIP vision tower ({dtype}) to {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the CLIP vision tower to ONNX")
+    parser.add_argument("--output", default="clip_vision_fp16.onnx", help="Path of the ONNX file to write")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    args = parser.parse_args()
+
+    export(args.output, args.opset)
@@ -4,17 +4,33 @@ FastAPI service for image similarity search using CLIP and FAISS
 """
 
 import os
-import json
+import asyncio
+import base64
+import platform
 import logging
-from typing import List, Dict, Any, Optional
+import uuid
+import time
+import zlib
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
+import orjson
+import pyarrow as pa
 import faiss
+import faiss.contrib.torch_utils  # Lets index.search take torch tensors without a numpy copy
+import httpx
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import torch
 from transformers import CLIPProcessor, CLIPModel
 
+try:
+    import fcntl
+except ImportError:  # Windows development hosts: no cross-process download lock
+    fcntl = None
+
+from batching import MicroBatcher
 from models import (
     ImageEmbedRequest, 
     TextEmbedRequest, 
@@ -22,10 +38,17 @@ from models import (
     ErrorResponse
 )
 from utils import (
+    CLIP_IMAGE_SIZE,
     decode_base64_image,
+    decode_and_preprocess_gpu,
     preprocess_image,
-    generate_image_embedding,
+    compute_image_features,
+    compute_image_features_onnx,
+    compute_text_features,
+    normalize_features,
+    tensors_to_host,
     generate_text_embedding,
+    image_content_hash,
     validate_embedding
 )
 
@@ -37,7 +60,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Image Similarity Search API",
     description="AI-powered image similarity search using CLIP and FAISS",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse  # orjson serializes the result lists much faster than stdlib json
 )
 
 # Add CORS middleware for Next.js integration
@@ -53,7 +77,47 @@ app.add_middleware(
 model: Optional[CLIPModel] = None
 processor: Optional[CLIPProcessor] = None
 index: Optional[faiss.Index] = None
-metadata: Optional[Dict[str, Any]] = None
+metadata: Optional[pa.ChunkedArray] = None  # Filename per index position, as one Arrow string column
+onnx_session: Optional[Any] = None  # ONNX Runtime vision tower, used for images when available
+gpu_resources: Optional[Any] = None  # Keeps FAISS GPU memory alive while the index is resident
+
+# Recent image features kept on the model device so /search can reuse them by id
+query_features: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+QUERY_FEATURES_CACHE_SIZE = int(os.environ.get("QUERY_FEATURES_CACHE_SIZE", 1024))
+
+# Image embeddings keyed by payload hash, so repeated uploads skip decode, preprocess and the ViT
+image_embeddings: "OrderedDict[bytes, Tuple[np.ndarray, float, torch.Tensor]]" = OrderedDict()
+IMAGE_EMBED_CACHE_SIZE = int(os.environ.get("IMAGE_EMBED_CACHE_SIZE", 8192))
+
+# Persistent on-disk cache for CDN artifacts, shared by all workers on the host; the Docker image sets /var/cache/faiss
+INDEX_CACHE_DIR = os.environ.get("FAISS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "faiss"))
+
+# Read-only mmap load; IO_FLAG_MMAP_IFC extends mmap to flat indexes on newer FAISS builds
+INDEX_IO_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+# Exported CLIP vision tower (see export_clip_onnx.py); torch serves images when it is absent
+CLIP_ONNX_PATH = os.environ.get("CLIP_ONNX_PATH", "clip_vision_fp16.onnx")
+
+# CLIP ViT-B/32 embedding size; /search/bin bodies are exactly this many float32 values
+EMBEDDING_DIM = 512
+
+# Micro-batching window for /embed/image: flush at this many images or after this many ms
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", 32))
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", 10))
+
+# "arrow" loads sample_metadata.arrow (written by create_index.py) via mmap instead of the JSON file
+METADATA_FORMAT = os.environ.get("METADATA_FORMAT", "json")
+
+# Inverted lists probed per query on IVF indexes (recall/latency tradeoff)
+SEARCH_NPROBE = int(os.environ.get("FAISS_NPROBE", 16))
+
+def check_faiss_simd():
+    """Warn when FAISS is running its scalar kernels on an x86 host"""
+    compile_options = faiss.get_compile_options()
+    logger.info(f"FAISS compile options: {compile_options}")
+    
+    if platform.machine().lower() in ("x86_64", "amd64") and "AVX" not in compile_options:
+        logger.warning("FAISS loaded without AVX2/AVX512 kernels; check the faiss-cpu wheel and leave FAISS_OPT_LEVEL unset so the loader auto-detects")
 
 def load_model():
     """Load CLIP model and processor"""
@@ -64,45 +128,152 @@ def load_model():
         model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
         processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
         
-        # Set device
+        # Set device; FP16 weights on GPU, CPU keeps FP32 weights and relies on autocast
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = model.to(device)
+        if device == "cuda":
+            model = model.half()
+        # channels_last lets the patch-embedding conv run on NHWC kernels
+        model = model.to(device, memory_format=torch.channels_last).eval()
         
         logger.info(f"CLIP model loaded successfully on {device}")
+        
+        load_onnx_session()
         return True
         
     except Exception as e:
         logger.error(f"Failed to load CLIP model: {str(e)}")
         return False
 
-def load_index():
+def compile_clip_towers():
+    """Compile the CLIP text and vision towers with TorchInductor and pre-warm them, keeping eager mode on failure"""
+    if not hasattr(torch, "compile"):
+        return
+    
+    # Images go through ONNX Runtime when a session is loaded, so only the text tower needs compiling then.
+    # Warm through the serving helpers so the recorded graphs match real inputs (channels_last, autocast)
+    towers = {"text_model": lambda: compute_text_features("a photo", processor, model)}
+    if onnx_session is None:
+        towers["vision_model"] = lambda: compute_image_features(
+            torch.zeros(1, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, device=model.device), model
+        )
+    
+    for name, warm in towers.items():
+        eager_tower = getattr(model, name)
+        try:
+            logger.info(f"Compiling CLIP {name}...")
+            # Batch size varies with micro-batching, so dynamic shapes are left to automatic detection
+            setattr(model, name, torch.compile(eager_tower, mode="reduce-overhead", fullgraph=True))
+            
+            # Compilation is lazy; trigger it now so the first request does not pay for it
+            with torch.inference_mode():
+                warm()
+            logger.info(f"CLIP {name} compiled")
+            
+        except Exception as e:
+            setattr(model, name, eager_tower)
+            logger.warning(f"torch.compile unavailable, using eager {name}: {str(e)}")
+
+def load_onnx_session():
+    """Load the ONNX Runtime vision tower if it has been exported and onnxruntime is installed"""
+    global onnx_session
+    
+    if not os.path.exists(CLIP_ONNX_PATH):
+        return
+    
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        logger.warning(f"{CLIP_ONNX_PATH} found but onnxruntime is not installed, using PyTorch for images")
+        return
+    
+    try:
+        available = ort.get_available_providers()
+        providers = [
+            provider for provider in ("CUDAExecutionProvider", "OpenVINOExecutionProvider", "CPUExecutionProvider")
+            if provider in available
+        ]
+        onnx_session = ort.InferenceSession(CLIP_ONNX_PATH, providers=providers)
+        logger.info(f"ONNX Runtime vision tower loaded with {onnx_session.get_providers()}")
+        
+    except Exception as e:
+        logger.warning(f"Failed to load ONNX vision tower, using PyTorch for images: {str(e)}")
+
+async def download_cached(client: httpx.AsyncClient, url: str, path: str, timeout: int = 300) -> str:
+    """Stream a CDN artifact to a persistent path, skipping the download when the cached copy is current"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    # Serialize concurrent workers on the same host so only one of them downloads
+    with open(f"{path}.lock", "w") as lock_file:
+        if fcntl is not None:
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+        
+        # Identify the remote artifact by ETag and size so unchanged files are reused across restarts
+        try:
+            head = await client.head(url, timeout=30)
+            head.raise_for_status()
+        except httpx.HTTPError as e:
+            # CDN unreachable: serve the last downloaded copy rather than failing startup
+            if os.path.exists(path):
+                logger.warning(f"Could not check {url} ({str(e)}), using cached {os.path.basename(path)}")
+                return path
+            raise
+        remote_tag = f"{head.headers.get('ETag', '')}:{head.headers.get('Content-Length', '')}"
+        tag_path = f"{path}.etag"
+        
+        if os.path.exists(path) and os.path.exists(tag_path):
+            with open(tag_path) as f:
+                if f.read() == remote_tag:
+                    logger.info(f"Using cached {os.path.basename(path)}")
+                    return path
+        
+        partial_path = f"{path}.part"
+        async with client.stream("GET", url, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(partial_path, "wb") as f:
+                if url.endswith(".zst"):
+                    # Decompress while streaming so neither copy is ever buffered in memory
+                    import zstandard
+                    with zstandard.ZstdDecompressor().stream_writer(f, closefd=False) as decompressor:
+                        async for chunk in response.aiter_bytes(chunk_size=1 << 20):
+                            decompressor.write(chunk)
+                else:
+                    async for chunk in response.aiter_bytes(chunk_size=1 << 20):
+                        f.write(chunk)
+        
+        # Atomic rename so workers that already mmap the old file keep a consistent view
+        os.replace(partial_path, path)
+        with open(tag_path, "w") as f:
+            f.write(remote_tag)
+    
+    return path
+
+async def load_index():
     """Load FAISS index and metadata from CDN"""
     global index, metadata
     
     try:
-        # CDN URLs from environment or defaults
+        # CDN URLs from environment or defaults; CDN_ARTIFACT_SUFFIX=.zst fetches compressed artifacts
         cdn_base = os.environ.get("CDN_BASE_URL", "https://drive.charpstar.net/indexing-test")
-        index_url = f"{cdn_base}/sample_index.faiss"
-        metadata_url = f"{cdn_base}/sample_metadata.json"
+        suffix = os.environ.get("CDN_ARTIFACT_SUFFIX", "")
+        index_url = f"{cdn_base}/sample_index.faiss{suffix}"
+        metadata_name = "sample_metadata.arrow" if METADATA_FORMAT == "arrow" else "sample_metadata.json"
+        metadata_url = f"{cdn_base}/{metadata_name}{suffix}"
         
-        # Download FAISS index from CDN
-        logger.info("Downloading FAISS index from CDN...")
-        import requests
-        index_response = requests.get(index_url, timeout=300)  # 5 minute timeout
-        index_response.raise_for_status()
+        # Download FAISS index and metadata from CDN concurrently into the persistent cache
+        logger.info("Downloading FAISS index and metadata from CDN...")
+        async with httpx.AsyncClient(http2=True, follow_redirects=True) as client:
+            index_path, metadata_path = await asyncio.gather(
+                download_cached(client, index_url, os.path.join(INDEX_CACHE_DIR, "sample_index.faiss")),
+                download_cached(client, metadata_url, os.path.join(INDEX_CACHE_DIR, metadata_name), timeout=60)
+            )
         
-        # Save index temporarily and load it
-        with open("temp_index.faiss", "wb") as f:
-            f.write(index_response.content)
-        index = faiss.read_index("temp_index.faiss")
-        os.remove("temp_index.faiss")  # Clean up
+        # Memory-map the index so only the pages touched by searches become resident
+        index = faiss.read_index(index_path, INDEX_IO_FLAGS)
+        configure_search_params(index)
+        index = move_index_to_gpu(index)
         logger.info(f"FAISS index loaded successfully with {index.ntotal} vectors")
         
-        # Download metadata from CDN
-        logger.info("Downloading metadata from CDN...")
-        metadata_response = requests.get(metadata_url, timeout=60)
-        metadata_response.raise_for_status()
-        metadata = metadata_response.json()
+        metadata = load_filenames(metadata_path)
         logger.info(f"Metadata loaded successfully with {len(metadata)} entries")
         
         return True
@@ -111,22 +282,147 @@ def load_index():
         logger.error(f"Failed to load index from CDN: {str(e)}")
         return False
 
+def load_filenames(path: str) -> pa.ChunkedArray:
+    """Load the filename column, the one metadata field search reads"""
+    if path.endswith(".arrow"):
+        # Zero-copy view over the memory-mapped IPC file; pages load only when looked up
+        return pa.ipc.open_file(pa.memory_map(path)).read_all().column("filename")
+    
+    with open(path, "rb") as f:
+        entries = orjson.loads(f.read())
+    
+    # Entries are either objects with a filename or bare filename strings
+    filenames = [
+        entry.get('filename', str(i)) if isinstance(entry, dict) else str(entry)
+        for i, entry in enumerate(entries)
+    ]
+    
+    # One contiguous string buffer instead of a Python object per filename
+    return pa.chunked_array([pa.array(filenames, type=pa.string())])
+
+def configure_search_params(index: faiss.Index):
+    """Apply query-time parameters for approximate indexes"""
+    try:
+        faiss.extract_index_ivf(index).nprobe = SEARCH_NPROBE
+    except RuntimeError:
+        pass  # Not an IVF index, nothing to tune
+
+def move_index_to_gpu(cpu_index: faiss.Index) -> faiss.Index:
+    """Clone the index onto the first GPU when one is available, otherwise keep it on CPU"""
+    global gpu_resources
+    
+    # CPU-only FAISS builds lack the GPU classes entirely
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return cpu_index
+    
+    try:
+        resources = faiss.StandardGpuResources()
+        
+        # FP16 storage halves scan bandwidth; the IVF coarse quantizer stays FP32 for routing accuracy
+        cloner_options = faiss.GpuClonerOptions()
+        cloner_options.useFloat16 = True
+        cloner_options.useFloat16CoarseQuantizer = False
+        
+        gpu_index = faiss.index_cpu_to_gpu(resources, 0, cpu_index, cloner_options)
+        gpu_resources = resources
+        logger.info("FAISS index moved to GPU 0")
+        return gpu_index
+        
+    except Exception as e:
+        logger.warning(f"Failed to move FAISS index to GPU, searching on CPU: {str(e)}")
+        return cpu_index
+
+def scores_to_similarity(scores: np.ndarray) -> np.ndarray:
+    """Convert raw FAISS scores to cosine similarity"""
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return scores
+    
+    # Legacy L2 indexes hold unit vectors, where ||a - b||^2 = 2 - 2 * cos
+    return 1.0 - scores / 2.0
+
+def compute_image_batch(pixel_values: torch.Tensor) -> List[Tuple[np.ndarray, float, torch.Tensor]]:
+    """
+    Embed a batch of preprocessed images with whichever vision backend is loaded
+    
+    Returns one (embedding, norm before normalization, normalized device features) entry per image.
+    Runs in the batcher's worker thread and ends with the host copy, which waits for the forward
+    pass, so the event loop never blocks on the GPU.
+    """
+    if onnx_session is not None:
+        image_features = compute_image_features_onnx(pixel_values, onnx_session)
+    else:
+        image_features = compute_image_features(pixel_values, model)
+    
+    features, norms = normalize_features(image_features)
+    embeddings, host_norms = tensors_to_host(features.half(), norms)
+    # Clone each row so a cached entry owns its 2 KB instead of pinning the whole batch's GPU storage
+    return [
+        (embeddings[row], float(host_norms[row]), features[row:row + 1].clone())
+        for row in range(len(embeddings))
+    ]
+
+# Concurrent /embed/image requests share one forward pass
+image_batcher = MicroBatcher(compute_image_batch, EMBED_MAX_BATCH_SIZE, EMBED_MAX_WAIT_MS)
+
+def cache_query_features(features: torch.Tensor) -> str:
+    """Keep normalized query features for later searches and return their id"""
+    embedding_id = uuid.uuid4().hex
+    query_features[embedding_id] = features
+    
+    # Evict the oldest entries once the cache is full
+    while len(query_features) > QUERY_FEATURES_CACHE_SIZE:
+        query_features.popitem(last=False)
+    
+    return embedding_id
+
+def warmup():
+    """Run one dummy embedding and one search so the first real requests skip compile and autotuning"""
+    start = time.perf_counter()
+    
+    # Go through the serving path so the compiled graph or ONNX session is the one that gets warmed
+    compute_image_batch(torch.zeros(1, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, device=model.device))
+    
+    # Compiles the numba validator on hosts where it is installed
+    validate_embedding(np.zeros(EMBEDDING_DIM, dtype=np.float32))
+    
+    if index is not None and index.ntotal > 0:
+        index.search(np.zeros((1, index.d), dtype=np.float32), min(10, index.ntotal))
+    
+    logger.info(f"Warmup finished in {time.perf_counter() - start:.2f}s")
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize model and index on startup"""
     logger.info("Starting up Image Similarity Search service...")
+    check_faiss_simd()
     
     # Load model
     if not load_model():
         logger.error("Failed to load CLIP model")
         return
+    image_batcher.start()
+    
+    # Inductor CUDA graphs are per thread, so compile and warm the towers on the thread that serves them
+    if model.device.type == "cuda":
+        await image_batcher.run_on_worker(compile_clip_towers)
     
     # Load index
-    if not load_index():
+    if not await load_index():
         logger.warning("Failed to load FAISS index - service will work but search will fail")
     
+    # Off the event loop, on the batch worker thread that later runs the real requests
+    try:
+        await image_batcher.run_on_worker(warmup)
+    except Exception as e:
+        logger.warning(f"Warmup failed: {str(e)}")
+    
     logger.info("Service startup complete")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks"""
+    await image_batcher.stop()
+
 @app.get("/")
 async def root():
     """Root endpoint with service information"""
@@ -177,34 +473,92 @@ async def index_info():
         "total_vectors": index.ntotal,
         "vector_dimension": index.d,
         "index_type": type(index).__name__,
-        "metadata_entries": len(metadata) if metadata else 0
+        "metadata_entries": len(metadata) if metadata is not None else 0
     }
 
-@app.post("/embed/image", response_model=EmbedResponse)
-async def embed_image(request: ImageEmbedRequest):
-    """Generate embedding for an image"""
-    if not model or not processor:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+async def embed_image_cached(image_data: str) -> Tuple[np.ndarray, float, torch.Tensor]:
+    """Embed a base64 image, reusing the result for payloads seen before"""
+    key = image_content_hash(image_data)
+    cached = image_embeddings.get(key)
+    if cached is not None:
+        image_embeddings.move_to_end(key)
+        return cached
     
-    try:
+    image_tensor = None
+    use_torch_gpu = onnx_session is None and model.device.type == "cuda"
+    
+    # JPEGs are decoded and preprocessed directly on the GPU when possible
+    if use_torch_gpu:
+        image_tensor = decode_and_preprocess_gpu(image_data, model.device)
+    
+    if image_tensor is None:
         # Decode base64 image
-        image = decode_base64_image(request.image_data)
+        image = decode_base64_image(image_data)
         if not image:
             raise HTTPException(status_code=400, detail="Invalid image data")
         
         # Preprocess image
         image_tensor = preprocess_image(image, processor)
         
-        # Generate embedding
-        embedding, embedding_norm = generate_image_embedding(image_tensor, model)
-        
-        # Validate embedding
-        if not validate_embedding(embedding):
-            raise HTTPException(status_code=500, detail="Invalid embedding generated")
+        # Batches are concatenated on one device, so match the GPU-decoded requests
+        if use_torch_gpu:
+            image_tensor = image_tensor.to(model.device)
+    
+    # Generate embedding in a shared batch, keeping the device tensor for searches by id
+    embedding, embedding_norm, features = await image_batcher.submit(image_tensor)
+    
+    # Validate embedding
+    if not validate_embedding(embedding):
+        raise HTTPException(status_code=500, detail="Invalid embedding generated")
+    
+    result = (embedding, embedding_norm, features)
+    image_embeddings[key] = result
+    while len(image_embeddings) > IMAGE_EMBED_CACHE_SIZE:
+        image_embeddings.popitem(last=False)
+    
+    return result
+
+def encode_embedding(embedding: np.ndarray, encoding: str) -> Dict[str, Any]:
+    """Embedding response fields as a JSON list or as base64 float16 bytes"""
+    if encoding == "b64":
+        # 1 KB of fp16 instead of ~6 KB of float text, and no float-to-string formatting
+        return {
+            "embedding_b64": base64.b64encode(embedding.astype("<f2", copy=False).tobytes()).decode("ascii"),
+            "dtype": "float16",
+            "shape": list(embedding.shape)
+        }
+    return {"embedding": embedding.tolist()}
+
+def decode_embedding_b64(embedding_b64: Any, dtype: Any) -> np.ndarray:
+    """Decode a base64 embedding sent to /search into float32"""
+    # Values come straight from the JSON body, so check types before b64decode sees them
+    if not isinstance(embedding_b64, str):
+        raise HTTPException(status_code=400, detail="embedding_b64 must be a base64 string")
+    if not isinstance(dtype, str) or dtype not in ("float16", "float32"):
+        raise HTTPException(status_code=400, detail="dtype must be float16 or float32")
+    try:
+        raw = base64.b64decode(embedding_b64, validate=True)
+    except ValueError:  # binascii.Error, or non-ASCII characters in the string
+        raise HTTPException(status_code=400, detail="Invalid embedding_b64")
+    
+    item_size = 2 if dtype == "float16" else 4
+    if len(raw) != EMBEDDING_DIM * item_size:
+        raise HTTPException(status_code=400, detail="Invalid embedding")
+    return np.frombuffer(raw, dtype="<f2" if dtype == "float16" else "<f4").astype(np.float32)
+
+@app.post("/embed/image", response_model=EmbedResponse, response_model_exclude_none=True)
+async def embed_image(request: ImageEmbedRequest):
+    """Generate embedding for an image"""
+    if not model or not processor:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    try:
+        embedding, embedding_norm, features = await embed_image_cached(request.image_data)
         
         return EmbedResponse(
-            embedding=embedding.tolist(),
-            embedding_norm=float(embedding_norm)
+            **encode_embedding(embedding, request.encoding),
+            embedding_norm=embedding_norm,
+            embedding_id=cache_query_features(features)
         )
         
     except HTTPException:
@@ -213,22 +567,24 @@ async def embed_image(request: ImageEmbedRequest):
         logger.error(f"Image embedding error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Embedding generation failed: {str(e)}")
 
-@app.post("/embed/text", response_model=EmbedResponse)
+@app.post("/embed/text", response_model=EmbedResponse, response_model_exclude_none=True)
 async def embed_text(request: TextEmbedRequest):
     """Generate embedding for text"""
     if not model or not processor:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
     try:
-        # Generate embedding
-        embedding, embedding_norm = generate_text_embedding(request.text, processor, model)
+        # Generate embedding on the model worker thread, which owns the compiled graphs
+        embedding, embedding_norm = await image_batcher.run_on_worker(
+            generate_text_embedding, request.text, processor, model
+        )
         
         # Validate embedding
         if not validate_embedding(embedding):
             raise HTTPException(status_code=500, detail="Invalid embedding generated")
         
         return EmbedResponse(
-            embedding=embedding.tolist(),
+            **encode_embedding(embedding, request.encoding),
             embedding_norm=float(embedding_norm)
         )
         
@@ -238,69 +594,131 @@ async def embed_text(request: TextEmbedRequest):
         logger.error(f"Text embedding error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Embedding generation failed: {str(e)}")
 
+def prepare_query(query_embedding: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Validate a query embedding and L2-normalize it in place"""
+    if not validate_embedding(query_embedding):
+        raise HTTPException(status_code=400, detail="Invalid embedding")
+    
+    # Only reported back as query_embedding_norm; normalization itself happens in FAISS
+    query_norm = np.linalg.norm(query_embedding)
+    
+    # Fused in-place normalization in C (zero vectors are left as-is, no Python branch needed)
+    query_vector = query_embedding.reshape(1, -1).astype(np.float32, copy=False)
+    faiss.normalize_L2(query_vector)
+    
+    return query_vector, query_norm
+
+def search_index(query_vector: Any, query_norm: float) -> Dict[str, Any]:
+    """Run the FAISS search for a normalized query and format the response"""
+    # Search in FAISS index
+    k = min(20, index.ntotal)  # Return top 20 results or all if less
+    scores, indices = index.search(query_vector, k)
+    
+    # Tensor queries return tensors on the query device
+    if isinstance(scores, torch.Tensor):
+        scores, indices = scores.cpu().numpy(), indices.cpu().numpy()
+    
+    # Drop padding ids (-1) and ids without metadata, then convert to Python scalars in bulk
+    ids = indices[0]
+    mask = (ids >= 0) & (ids < len(metadata))
+    similarities = scores_to_similarity(scores[0][mask])
+    ids = ids[mask]
+    filenames = metadata.take(ids).to_pylist()
+    
+    # Format results
+    results = [
+        {
+            "rank": rank + 1,
+            "index": idx,
+            "filename": filename,
+            "filepath": f"/sample-images/{filename}",
+            "similarity": similarity,
+            "distance": distance
+        }
+        for rank, (idx, filename, similarity, distance) in enumerate(
+            zip(ids.tolist(), filenames, similarities.tolist(), (1.0 - similarities).tolist())
+        )
+    ]
+    
+    return {
+        "query_embedding_norm": float(query_norm),
+        "total_results": len(results),
+        "results": results
+    }
+
 @app.post("/search")
 async def search_similar_images(request: Request):
     """Search for similar images using embedding"""
-    if not index or not metadata:
+    if not index or metadata is None:
         raise HTTPException(status_code=503, detail="Index not loaded")
     
     try:
         # Parse request body
-        body = await request.json()
+        body = orjson.loads(await request.body())
+        embedding_id = body.get("embedding_id")
         embedding = body.get("embedding")
+        embedding_b64 = body.get("embedding_b64")
         
-        if not embedding:
-            raise HTTPException(status_code=400, detail="Embedding is required")
+        if embedding_id:
+            # Reuse normalized features from /embed/image without a host round trip
+            query_vector = query_features.get(embedding_id)
+            if query_vector is None:
+                raise HTTPException(status_code=404, detail="Unknown or expired embedding_id")
+            
+            # A CPU index cannot read CUDA memory
+            if gpu_resources is None:
+                query_vector = query_vector.cpu()
+            query_norm = 1.0
+        elif embedding_b64:
+            # Binary form returned by /embed/* with encoding=b64
+            query_embedding = decode_embedding_b64(embedding_b64, body.get("dtype", "float16"))
+            query_vector, query_norm = prepare_query(query_embedding)
+        else:
+            if not embedding:
+                raise HTTPException(status_code=400, detail="Embedding is required")
+            
+            # Convert to numpy array
+            query_vector, query_norm = prepare_query(np.asarray(embedding, dtype=np.float32))
         
-        # Convert to numpy array
-        query_embedding = np.array(embedding, dtype=np.float32)
+        return search_index(query_vector, query_norm)
         
-        # Validate embedding
-        if not validate_embedding(query_embedding):
-            raise HTTPException(status_code=400, detail="Invalid embedding")
-        
-        # Normalize query embedding
-        query_norm = np.linalg.norm(query_embedding)
-        if query_norm > 0:
-            query_embedding = query_embedding / query_norm
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Search error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+@app.post("/search/bin")
+async def search_similar_images_binary(request: Request):
+    """Search using a raw little-endian float32 embedding body (application/octet-stream)"""
+    if not index or metadata is None:
+        raise HTTPException(status_code=503, detail="Index not loaded")
+    
+    try:
+        body = await request.body()
+        if len(body) != EMBEDDING_DIM * 4:
+            raise HTTPException(status_code=400, detail=f"Expected {EMBEDDING_DIM * 4} bytes of float32 data")
         
-        # Search in FAISS index
-        k = min(20, index.ntotal)  # Return top 20 results or all if less
-        distances, indices = index.search(query_embedding.reshape(1, -1), k)
+        # Optional integrity check for clients that send one
+        checksum = request.headers.get("X-Embedding-CRC32")
+        if checksum is not None:
+            try:
+                expected_crc = int(checksum)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="X-Embedding-CRC32 must be a decimal integer")
+            if zlib.crc32(body) != expected_crc:
+                raise HTTPException(status_code=400, detail="Embedding checksum mismatch")
         
-        # Format results
-        results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx < len(metadata):
-                metadata_item = metadata[idx]  # Get the metadata item
-                
-                # Extract filename - handle both string and object formats
-                if isinstance(metadata_item, dict):
-                    filename = metadata_item.get('filename', str(idx))
-                else:
-                    filename = str(metadata_item)
-                
-                similarity = 1.0 - distance  # Convert distance to similarity
-                
-                results.append({
-                    "rank": i + 1,
-                    "index": int(idx),
-                    "filename": filename,  # Now it's always a string
-                    "filepath": f"/sample-images/{filename}",
-                    "similarity": float(similarity),
-                    "distance": float(distance)
-                })
+        # frombuffer views the read-only request bytes; copy once so normalization can run in place
+        query_embedding = np.frombuffer(body, dtype="<f4").copy()
+        query_vector, query_norm = prepare_query(query_embedding)
         
-        return {
-            "query_embedding_norm": float(query_norm),
-            "total_results": len(results),
-            "results": results
-        }
+        return search_index(query_vector, query_norm)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Search error: {str(e)}")
+        logger.error(f"Binary search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 if __name__ == "__main__":
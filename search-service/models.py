@@ -1,10 +1,11 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 import base64
 
 class ImageEmbedRequest(BaseModel):
     """Request model for image embedding"""
     image_data: str = Field(..., description="Base64 encoded image data")
+    encoding: Literal["list", "b64"] = Field("list", description="Return the embedding as a JSON list or as base64 float16 bytes")
     
     class Config:
         schema_extra = {
@@ -16,6 +17,7 @@ class ImageEmbedRequest(BaseModel):
 class TextEmbedRequest(BaseModel):
     """Request model for text embedding"""
     text: str = Field(..., min_length=1, max_length=1000, description="Text to embed")
+    encoding: Literal["list", "b64"] = Field("list", description="Return the embedding as a JSON list or as base64 float16 bytes")
     
     class Config:
         schema_extra = {
@@ -26,14 +28,18 @@ class TextEmbedRequest(BaseModel):
 
 class EmbedResponse(BaseModel):
     """Response model for embeddings"""
-    embedding: List[float] = Field(..., description="512-dimensional embedding vector")
-    embedding_norm: float = Field(..., description="L2 norm of the embedding vector")
+    embedding: Optional[List[float]] = Field(None, description="512-dimensional embedding vector (encoding=list)")
+    embedding_b64: Optional[str] = Field(None, description="Base64 of the raw little-endian embedding bytes (encoding=b64)")
+    dtype: Optional[str] = Field(None, description="Element type of embedding_b64")
+    shape: Optional[List[int]] = Field(None, description="Shape of embedding_b64")
+    embedding_norm: float = Field(..., description="L2 norm of the CLIP features before normalization; the embedding itself is unit-norm")
+    embedding_id: Optional[str] = Field(None, description="Server-side handle to search with this embedding without resending it")
     
     class Config:
         schema_extra = {
             "example": {
                 "embedding": [0.1, 0.2, 0.3, ...],
-                "embedding_norm": 1.0
+                "embedding_norm": 10.42
             }
         }
 
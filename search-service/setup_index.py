@@ -54,6 +54,7 @@ def create_index():
             print("✅ Index creation completed successfully!")
             print("   - sample_index.faiss")
             print("   - sample_metadata.json")
+            print("   - sample_metadata.arrow")
             return True
         else:
             print("❌ Index creation failed!")
@@ -4,6 +4,11 @@ Production startup script for the image similarity search service
 """
 
 import os
+
+# Persist TorchInductor kernels so restarts reuse the compiled CLIP towers instead of recompiling
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "torchinductor"))
+os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+
 import uvicorn
 from main import app
 
@@ -23,5 +28,7 @@ if __name__ == "__main__":
         host=host,
         port=port,
         workers=1,  # Single worker for now
+        loop="uvloop",  # libuv event loop and C HTTP parser, both shipped with uvicorn[standard]
+        http="httptools",
         log_level="info"
-    ) 
\ No newline at end of file
+    )
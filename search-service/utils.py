@@ -1,14 +1,107 @@
+from __future__ import annotations
+
 import base64
+import binascii
+import hashlib
 import io
 import logging
-from typing import Tuple, Optional
-import torch
+import functools
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, List, Tuple, Optional, Union
 import numpy as np
-from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from PIL import Image, UnidentifiedImageError
+
+if TYPE_CHECKING:  # torch and transformers are imported on first use, not at module load
+    import torch
+    from transformers import CLIPProcessor, CLIPModel
+from utils_fast import validate_fast
+
+try:
+    import xxhash
+except ImportError:  # Optional; blake2b is slower but always available
+    xxhash = None
+
+try:
+    import pybase64 as b64
+except ImportError:  # Optional SIMD decoder; stdlib base64 has the same b64decode signature
+    b64 = base64
 
 logger = logging.getLogger(__name__)
 
+# CLIP ViT-B/32 preprocessing constants (CLIPImageProcessor defaults)
+CLIP_IMAGE_SIZE = 224
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+_CLIP_MEAN_255 = np.array(CLIP_MEAN, dtype=np.float32) * 255
+_CLIP_INV_STD_255 = 1.0 / (np.array(CLIP_STD, dtype=np.float32) * 255)
+
+# LRU of text embeddings keyed by normalized query text; repeated queries skip the text tower
+_TEXT_CACHE: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+_TEXT_CACHE_MAX = 10_000
+_TEXT_CACHE_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _get_torch():
+    """Import torch on first use"""
+    import torch
+    return torch
+
+def autocast_dtype(device: torch.device) -> Optional[torch.dtype]:
+    """
+    Pick the reduced-precision dtype for CLIP inference on a device
+    
+    Args:
+        device: Device the model runs on
+    
+    Returns:
+        torch.float16 on CUDA, torch.bfloat16 on CPUs with native BF16/AMX, otherwise None (FP32)
+    """
+    torch = _get_torch()
+    if device.type == "cuda":
+        return torch.float16
+    
+    # Emulated BF16 is slower than FP32, so only use it where the CPU supports it natively
+    for check in ("_is_amx_tile_supported", "_is_avx512_bf16_supported"):
+        supported = getattr(torch.cpu, check, None)
+        if supported is not None and supported():
+            return torch.bfloat16
+    
+    return None
+
+def _strip_data_url(image_data: str) -> str:
+    """Drop a data URL prefix (data:image/jpeg;base64,...) if present"""
+    return image_data.partition(',')[2] if image_data.startswith('data:') else image_data
+
+def decode_base64_bytes(image_data: str) -> bytes:
+    """
+    Decode a base64 image payload to raw bytes
+    
+    Args:
+        image_data: Base64 encoded image string (with or without data URL prefix)
+    
+    Returns:
+        Encoded image file bytes
+    """
+    return b64.b64decode(_strip_data_url(image_data), validate=False)
+
+def image_content_hash(image_data: str) -> bytes:
+    """
+    Hash a base64 image payload for use as a cache key
+    
+    Args:
+        image_data: Base64 encoded image string (with or without data URL prefix)
+    
+    Returns:
+        16-byte digest of the encoded image
+    """
+    # Hash the base64 text itself: it maps 1:1 to the image bytes and avoids a second decode
+    # utf-8 is byte-identical for valid base64 and cannot fail, so bad payloads reach decode and get a 400
+    raw = _strip_data_url(image_data).encode('utf-8')
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(raw)
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
 def decode_base64_image(image_data: str) -> Optional[Image.Image]:
     """
     Decode base64 image data to PIL Image
@@ -20,45 +113,238 @@ def decode_base64_image(image_data: str) -> Optional[Image.Image]:
         PIL Image object or None if decoding fails
     """
     try:
-        # Remove data URL prefix if present
-        if image_data.startswith('data:'):
-            image_data = image_data.split(',')[1]
-        
         # Decode base64
-        image_bytes = base64.b64decode(image_data)
+        image_bytes = decode_base64_bytes(image_data)
         
         # Convert to PIL Image
         image = Image.open(io.BytesIO(image_bytes))
         
+        # JPEGs decode with a scaled IDCT straight to the smallest size that still covers the 224px crop
+        image.draft('RGB', (CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE))
+        
+        # Decode now so truncated files fail here rather than during preprocessing
+        image.load()
+        
         # Convert to RGB if necessary
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
         return image
         
-    except Exception as e:
+    # Pillow raises SyntaxError for corrupt PNG chunks and EOFError for some truncated streams
+    except (binascii.Error, UnidentifiedImageError, OSError, ValueError, SyntaxError, EOFError,
+            Image.DecompressionBombError) as e:
         logger.error(f"Failed to decode base64 image: {str(e)}")
         return None
 
-def preprocess_image(image: Image.Image, processor: CLIPProcessor) -> torch.Tensor:
+@functools.lru_cache(maxsize=None)
+def _clip_normalization(device: torch.device) -> Tuple[torch.Tensor, torch.Tensor]:
+    """CLIP mean/std as (3, 1, 1) tensors, created once per device"""
+    torch = _get_torch()
+    mean = torch.tensor(CLIP_MEAN, device=device).view(3, 1, 1)
+    std = torch.tensor(CLIP_STD, device=device).view(3, 1, 1)
+    return mean, std
+
+def decode_and_preprocess_gpu(image_data: str, device: torch.device) -> Optional[torch.Tensor]:
     """
-    Preprocess image for CLIP model
+    Decode a base64 JPEG with nvJPEG and apply CLIP preprocessing on the GPU
     
     Args:
-        image: PIL Image object
-        processor: CLIP processor
+        image_data: Base64 encoded image string (with or without data URL prefix)
+        device: CUDA device to decode on
     
     Returns:
-        Preprocessed image tensor
+        Preprocessed image tensor on the device, or None when the GPU path does not apply
+        (torchvision missing, not a JPEG, or decoding failed) and the PIL path should be used
     """
+    torch = _get_torch()
+    try:
+        from torchvision.io import ImageReadMode, decode_jpeg
+        from torchvision.transforms import InterpolationMode
+        from torchvision.transforms.v2 import functional as F
+    except ImportError:
+        return None
+    
     try:
-        # Process image with CLIP processor
-        inputs = processor(images=image, return_tensors="pt")
-        return inputs['pixel_values']
+        image_bytes = decode_base64_bytes(image_data)
+        
+        # nvJPEG only handles JPEG; other formats go through PIL
+        if not image_bytes.startswith(b'\xff\xd8'):
+            return None
+        
+        raw = torch.frombuffer(bytearray(image_bytes), dtype=torch.uint8)
+        image = decode_jpeg(raw, mode=ImageReadMode.RGB, device=device)
+        
+        # Same steps as CLIPImageProcessor: shortest edge resize, center crop, rescale, normalize
+        image = F.resize(image, [CLIP_IMAGE_SIZE], interpolation=InterpolationMode.BICUBIC, antialias=True)
+        image = F.center_crop(image, [CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE])
+        mean, std = _clip_normalization(device)
+        image = image.float().div_(255).sub_(mean).div_(std)
+        
+        return image.unsqueeze(0)
         
     except Exception as e:
-        logger.error(f"Failed to preprocess image: {str(e)}")
-        raise e
+        logger.warning(f"GPU image decode failed, falling back to PIL: {str(e)}")
+        return None
+
+def _matches_clip_defaults(processor: CLIPProcessor) -> bool:
+    """Whether the processor uses the 224px shortest-edge resize and crop the fast path hardcodes"""
+    image_processor = processor.image_processor
+    return (
+        image_processor.size == {"shortest_edge": CLIP_IMAGE_SIZE}
+        and image_processor.crop_size == {"height": CLIP_IMAGE_SIZE, "width": CLIP_IMAGE_SIZE}
+        and tuple(image_processor.image_mean) == CLIP_MEAN
+        and tuple(image_processor.image_std) == CLIP_STD
+    )
+
+def _fast_preprocess(image: Image.Image) -> torch.Tensor:
+    """
+    CLIPImageProcessor steps in one PIL resize and one vectorized numpy pass
+    
+    Args:
+        image: RGB PIL Image object
+    
+    Returns:
+        Preprocessed image tensor of shape (1, 3, 224, 224), channels_last strided
+    """
+    torch = _get_torch()
+    # Shortest edge to 224 with bicubic resampling, then center crop, as CLIPImageProcessor does
+    width, height = image.size
+    short, long = (width, height) if width <= height else (height, width)
+    long = int(CLIP_IMAGE_SIZE * long / short)
+    new_width, new_height = (CLIP_IMAGE_SIZE, long) if width <= height else (long, CLIP_IMAGE_SIZE)
+    image = image.resize((new_width, new_height), Image.BICUBIC)
+    
+    left = (new_width - CLIP_IMAGE_SIZE) // 2
+    top = (new_height - CLIP_IMAGE_SIZE) // 2
+    image = image.crop((left, top, left + CLIP_IMAGE_SIZE, top + CLIP_IMAGE_SIZE))
+    
+    # Rescale and normalize in one broadcast over the HWC array
+    pixels = (np.asarray(image, dtype=np.float32) - _CLIP_MEAN_255) * _CLIP_INV_STD_255
+    
+    # HWC viewed as NCHW without a copy, which is exactly the channels_last layout
+    return torch.from_numpy(pixels).permute(2, 0, 1).unsqueeze(0)
+
+def preprocess_image(image: Union[Image.Image, List[Image.Image]], processor: CLIPProcessor) -> torch.Tensor:
+    """
+    Preprocess image for CLIP model
+    
+    Args:
+        image: PIL Image object, or a list of them for a batch
+        processor: CLIP processor
+    
+    Returns:
+        Preprocessed image tensor of shape (batch, 3, 224, 224)
+    """
+    torch = _get_torch()
+    images = image if isinstance(image, list) else [image]
+    
+    # RGB images with the stock ViT-B/32 config skip the CLIPImageProcessor pipeline
+    if _matches_clip_defaults(processor) and all(img.mode == 'RGB' for img in images):
+        tensors = [_fast_preprocess(img) for img in images]
+        return tensors[0] if len(tensors) == 1 else torch.cat(tensors)
+    
+    # Process image with CLIP processor
+    inputs = processor(images=image, return_tensors="pt")
+    return inputs['pixel_values']
+
+def compute_image_features(image_tensor: torch.Tensor, model: CLIPModel) -> torch.Tensor:
+    """
+    Run the CLIP vision tower and keep the result on the model device
+    
+    Args:
+        image_tensor: Preprocessed image tensor
+        model: CLIP model
+    
+    Returns:
+        Unnormalized FP32 image features of shape (batch, 512)
+    """
+    torch = _get_torch()
+    dtype = autocast_dtype(model.device)
+    with torch.inference_mode(), torch.autocast(device_type=model.device.type, dtype=dtype, enabled=dtype is not None):
+        # Generate image features in FP32 so FAISS always receives float32 vectors
+        pixel_values = image_tensor.to(model.device, dtype=model.dtype, memory_format=torch.channels_last)
+        return model.get_image_features(pixel_values).float()
+
+def compute_image_features_onnx(image_tensor: torch.Tensor, session: Any) -> torch.Tensor:
+    """
+    Run the exported CLIP vision tower with ONNX Runtime
+    
+    Args:
+        image_tensor: Preprocessed image tensor
+        session: onnxruntime.InferenceSession created from export_clip_onnx.py output
+    
+    Returns:
+        Unnormalized FP32 image features of shape (batch, 512) on CPU
+    """
+    torch = _get_torch()
+    # Feed the dtype the graph was exported with (FP16 on GPU exports)
+    input_meta = session.get_inputs()[0]
+    input_dtype = np.float16 if input_meta.type == "tensor(float16)" else np.float32
+    pixel_values = image_tensor.cpu().numpy().astype(input_dtype, copy=False)
+    
+    image_features = session.run(None, {input_meta.name: pixel_values})[0]
+    
+    # FP32 so FAISS always receives float32 vectors
+    return torch.from_numpy(image_features.astype(np.float32, copy=False))
+
+def normalize_features(features: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    L2-normalize feature rows on their device
+    
+    Args:
+        features: Unnormalized features of shape (batch, 512)
+    
+    Returns:
+        Tuple of (normalized_features, pre_normalization_norms)
+    """
+    # One reduction serves both the reported norm and the division
+    norms = features.norm(p=2, dim=1, keepdim=True)
+    return features / norms.clamp_min(1e-12), norms.squeeze(1)
+
+def tensors_to_host(*tensors: torch.Tensor) -> List[np.ndarray]:
+    """
+    Copy tensors to host memory with a single device sync
+    
+    Args:
+        tensors: Tensors on any device
+    
+    Returns:
+        numpy arrays in the same order
+    """
+    torch = _get_torch()
+    cuda_devices = {t.device for t in tensors if t.is_cuda}
+    if not cuda_devices:
+        return [t.numpy() for t in tensors]
+    
+    # Pinned destinations make each copy an async DMA; all copies are queued before the one wait
+    host = []
+    for t in tensors:
+        if t.is_cuda:
+            pinned = torch.empty(t.shape, dtype=t.dtype, pin_memory=True)
+            pinned.copy_(t, non_blocking=True)
+            t = pinned
+        host.append(t)
+    
+    for device in cuda_devices:
+        torch.cuda.current_stream(device).synchronize()
+    
+    return [t.numpy() for t in host]
+
+def features_to_embedding(features: torch.Tensor, norms: torch.Tensor) -> Tuple[np.ndarray, float]:
+    """
+    Copy a single normalized feature row and its norm to host memory
+    
+    Args:
+        features: Normalized features of shape (1, 512)
+        norms: Norms before normalization of shape (1,)
+    
+    Returns:
+        Tuple of (1-D float16 embedding array, norm of the features before normalization)
+    """
+    # Cast on the device so only half the bytes cross to the host
+    embedding, norm = tensors_to_host(features.detach().squeeze(0).half(), norms)
+    return embedding, float(norm[0])
 
 def generate_image_embedding(image_tensor: torch.Tensor, model: CLIPModel) -> Tuple[np.ndarray, float]:
     """
@@ -69,27 +355,66 @@ def generate_image_embedding(image_tensor: torch.Tensor, model: CLIPModel) -> Tu
         model: CLIP model
     
     Returns:
-        Tuple of (embedding_array, embedding_norm)
+        Tuple of (embedding_array, norm of the features before normalization)
     """
-    try:
-        with torch.no_grad():
-            # Generate image features
-            image_features = model.get_image_features(image_tensor)
-            
-            # Normalize the features
-            image_features = torch.nn.functional.normalize(image_features, p=2, dim=1)
-            
-            # Convert to numpy array
-            embedding = image_features.cpu().numpy().flatten()
-            
-            # Calculate L2 norm
-            embedding_norm = np.linalg.norm(embedding)
-            
-            return embedding, embedding_norm
-            
-    except Exception as e:
-        logger.error(f"Failed to generate image embedding: {str(e)}")
-        raise e
+    features, norms = normalize_features(compute_image_features(image_tensor, model))
+    return features_to_embedding(features, norms)
+
+def generate_image_embeddings(images: List[Image.Image], processor: CLIPProcessor, model: CLIPModel) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate embeddings for several images in one forward pass
+    
+    Args:
+        images: PIL Image objects
+        processor: CLIP processor
+        model: CLIP model
+    
+    Returns:
+        Tuple of (float16 embeddings of shape (B, 512), FP32 norms before normalization of shape (B,))
+    """
+    features, norms = normalize_features(compute_image_features(preprocess_image(images, processor), model))
+    embeddings, norms = tensors_to_host(features.half(), norms)
+    return embeddings, norms
+
+def compute_text_features(text: Union[str, List[str]], processor: CLIPProcessor, model: CLIPModel) -> torch.Tensor:
+    """
+    Tokenize and run the CLIP text tower
+    
+    Args:
+        text: Input text string or list of strings
+        processor: CLIP processor
+        model: CLIP model
+    
+    Returns:
+        Unnormalized FP32 text features of shape (batch, 512)
+    """
+    torch = _get_torch()
+    # A compiled text tower gets one fixed 77-token shape instead of recompiling per query length
+    padding = "max_length" if hasattr(model.text_model, "_orig_mod") else True
+    
+    dtype = autocast_dtype(model.device)
+    with torch.inference_mode(), torch.autocast(device_type=model.device.type, dtype=dtype, enabled=dtype is not None):
+        # Process text with CLIP processor; lists are padded to the longest entry
+        inputs = processor(text=text, return_tensors="pt", padding=padding, truncation=True).to(model.device)
+        
+        # Generate text features in FP32 so FAISS always receives float32 vectors
+        return model.get_text_features(**inputs).float()
+
+def generate_text_embeddings(texts: List[str], processor: CLIPProcessor, model: CLIPModel) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generate embeddings for several texts in one forward pass
+    
+    Args:
+        texts: Input text strings
+        processor: CLIP processor
+        model: CLIP model
+    
+    Returns:
+        Tuple of (float16 embeddings of shape (B, 512), FP32 norms before normalization of shape (B,))
+    """
+    features, norms = normalize_features(compute_text_features(texts, processor, model))
+    embeddings, norms = tensors_to_host(features.half(), norms)
+    return embeddings, norms
 
 def generate_text_embedding(text: str, processor: CLIPProcessor, model: CLIPModel) -> Tuple[np.ndarray, float]:
     """
@@ -101,46 +426,42 @@ def generate_text_embedding(text: str, processor: CLIPProcessor, model: CLIPMode
         model: CLIP model
     
     Returns:
-        Tuple of (embedding_array, embedding_norm)
+        Tuple of (embedding_array, norm of the features before normalization)
     """
-    try:
-        with torch.no_grad():
-            # Process text with CLIP processor
-            inputs = processor(text=text, return_tensors="pt", padding=True, truncation=True)
-            
-            # Generate text features
-            text_features = model.get_text_features(**inputs)
-            
-            # Normalize the features
-            text_features = torch.nn.functional.normalize(text_features, p=2, dim=1)
-            
-            # Convert to numpy array
-            embedding = text_features.cpu().numpy().flatten()
-            
-            # Calculate L2 norm
-            embedding_norm = np.linalg.norm(embedding)
-            
-            return embedding, embedding_norm
-            
-    except Exception as e:
-        logger.error(f"Failed to generate text embedding: {str(e)}")
-        raise e
+    # The CLIP tokenizer lowercases and strips, so these keys map to identical embeddings
+    key = text.strip().lower()
+    with _TEXT_CACHE_LOCK:
+        cached = _TEXT_CACHE.get(key)
+        if cached is not None:
+            _TEXT_CACHE.move_to_end(key)
+            return cached
+    
+    text_features, norms = normalize_features(compute_text_features(text, processor, model))
+    result = features_to_embedding(text_features, norms)
+    
+    # Cached arrays are shared between callers
+    result[0].flags.writeable = False
+    with _TEXT_CACHE_LOCK:
+        _TEXT_CACHE[key] = result
+        if len(_TEXT_CACHE) > _TEXT_CACHE_MAX:
+            _TEXT_CACHE.popitem(last=False)
+    
+    return result
 
 def validate_embedding(embedding: np.ndarray, expected_dim: int = 512) -> bool:
     """
     Validate embedding vector
     
     Args:
-        embedding: Embedding vector
+        embedding: Embedding vector (float16 or float32)
         expected_dim: Expected dimension
     
     Returns:
         True if valid, False otherwise
     """
-    if embedding.shape[0] != expected_dim:
-        return False
-    
-    if np.isnan(embedding).any() or np.isinf(embedding).any():
-        return False
+    # numba has no float16 loops; isfinite handles half precision natively
+    if validate_fast is not None and embedding.ndim == 1 and embedding.dtype != np.float16:
+        return validate_fast(embedding, expected_dim)
     
-    return True 
\ No newline at end of file
+    # Shape first, then one pass that rejects both NaN and Inf
+    return embedding.shape[0] == expected_dim and bool(np.isfinite(embedding).all()) 
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+Optional numba-compiled kernels for per-request hot paths
+
+Every name here is None when numba is not installed; callers keep their numpy fallback.
+"""
+
+import math
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Optional dependency
+    njit = None
+
+if njit is not None:
+    # No fastmath: it lets LLVM assume values are finite and fold the check away
+    @njit(cache=True, boundscheck=False)
+    def _validate(embedding: np.ndarray, expected_dim: int) -> bool:
+        if embedding.shape[0] != expected_dim:
+            return False
+        for x in embedding:
+            if not math.isfinite(x):
+                return False
+        return True
+
+    def validate_fast(embedding: np.ndarray, expected_dim: int = 512) -> bool:
+        """
+        Single early-exit pass over a 1-D embedding, without numpy temporaries
+        
+        Args:
+            embedding: 1-D embedding vector
+            expected_dim: Expected dimension
+        
+        Returns:
+            True if the shape matches and every value is finite
+        """
+        return bool(_validate(embedding, expected_dim))
+else:
+    validate_fast = None